@@ -1,28 +1,85 @@
 # -*- coding: utf-8 -*-
 
 
+import atexit
 import aiohttp
 import asyncio
+import threading
 
-from typing import Optional
+from typing import Dict, Optional
+from weakref import WeakSet
 from functools import wraps
 
 
 __all__ = ('runner', 'Client')
 
 
+# 同一个 event loop 上的所有客户端共用一个连接池, 值为 [连接池, 使用中的客户端数]
+# 连接池引用了 event loop, 所以 event loop 关闭后由 create_session 清理对应的记录
+_CONNECTOR_REGISTRY: "Dict[asyncio.AbstractEventLoop, list]" = {}
+
+
+# 阻塞模式下每个线程一个 event loop, 同一线程的客户端共用
+_BLOCKING_LOOPS: Dict[threading.Thread, asyncio.AbstractEventLoop] = {}
+_BLOCKING_LOCK = threading.Lock()
+_BLOCKING_CLIENTS: "WeakSet[Client]" = WeakSet()
+
+
+def _blocking_loop():
+    """当前线程阻塞模式使用的 event loop, 首次使用时创建"""
+    thread = threading.current_thread()
+    loop = _BLOCKING_LOOPS.get(thread)
+    if loop is not None and not loop.is_closed():
+        return loop
+    with _BLOCKING_LOCK:
+        # 顺便关闭已经结束的线程留下的 event loop
+        for t in [t for t in _BLOCKING_LOOPS if not t.is_alive()]:
+            _BLOCKING_LOOPS.pop(t).close()
+        loop = _BLOCKING_LOOPS[thread] = asyncio.new_event_loop()
+    return loop
+
+
+@atexit.register
+def _shutdown():
+    """进程退出时关闭仍未关闭的阻塞模式客户端, 以及创建的 event loop"""
+    for client in list(_BLOCKING_CLIENTS):
+        loop = client._session_loop
+        if client._session and loop is not None and not loop.is_closed() and not loop.is_running():
+            loop.run_until_complete(Client.close(client))
+    with _BLOCKING_LOCK:
+        for loop in _BLOCKING_LOOPS.values():
+            if not loop.is_closed() and not loop.is_running():
+                loop.close()
+        _BLOCKING_LOOPS.clear()
+
+
 def runner(coro):
-    """函数执行包装器"""
+    """
+    标记需要根据运行模式执行的协程
+
+    ``async`` 模式下直接调用协程, ``blocking`` 模式下在实例初始化时绑定同步包装
+    """
+    coro.__runner__ = True
+    return coro
+
+
+def _blocking(client, coro):
+    """同步阻塞执行包装器"""
 
     @wraps(coro)
-    def inner(self, *args, **kwargs):
-        if self.mode == 'async':
-            return coro(self, *args, **kwargs)
-        return self._loop.run_until_complete(coro(self, *args, **kwargs))
+    def inner(*args, **kwargs):
+        return client._get_loop().run_until_complete(coro(client, *args, **kwargs))
 
     return inner
 
 
+def _collect_runners(cls):
+    return tuple(
+        name for name in dir(cls)
+        if getattr(getattr(cls, name, None), '__runner__', False)
+    )
+
+
 class Client(object):
     """
     基础客户端
@@ -40,7 +97,7 @@ class Client(object):
         - ``async``: 默认模式，非阻塞
         - ``blocking``: 同步阻塞模式
 
-    :param path: event loop
+    :param loop: event loop, 可选, 仅阻塞模式使用, 默认同一线程的阻塞模式客户端共用一个
 
     """
 
@@ -52,9 +109,37 @@ class Client(object):
         **kwargs
     ):
         self._mode = mode
-        self._loop = loop or asyncio.get_event_loop()
+        self._loop = loop
         self._session = None
+        self._session_loop = None
+        self._connector_loop = None
         self.opts = kwargs
+        self._bind_runners()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._runners = _collect_runners(cls)
+
+    def _get_loop(self):
+        """阻塞模式使用的 event loop, 未指定时使用当前线程的 event loop"""
+        return self._loop or _blocking_loop()
+
+    def _current_loop(self):
+        try:
+            return asyncio.get_running_loop()
+        except RuntimeError:
+            return self._get_loop()
+
+    def _bind_runners(self):
+        for name in self._runners:
+            if self._mode == 'async':
+                self.__dict__.pop(name, None)
+            else:
+                setattr(self, name, _blocking(self, getattr(type(self), name)))
+        if self._mode == 'async':
+            _BLOCKING_CLIENTS.discard(self)
+        else:
+            _BLOCKING_CLIENTS.add(self)
 
     @property
     def mode(self):
@@ -65,11 +150,13 @@ class Client(object):
         if mode not in ('async', 'blocking'):
             raise ValueError('Invalid running mode')
         self._mode = mode
+        self._bind_runners()
 
     @property
     def session(self):
         if self._session is None:
             self._session = self.create_session(**self.opts)
+            self._session_loop = self._current_loop()
         return self._session
 
     def __enter__(self):
@@ -84,15 +171,58 @@ class Client(object):
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self.close()
 
-    def __del__(self):
-        if not self._loop.is_closed() and self._session:
-            asyncio.ensure_future(self._session.close(), loop=self._loop)
-
     @runner
     async def close(self):
-        if self._session:
+        if self._session and not self._session.closed:
             await self._session.close()
-            self._session = None
+        self._session = None
+        self._session_loop = None
+        await self._release_connector()
+
+    async def _release_connector(self):
+        """最后一个使用共用连接池的客户端关闭时, 关闭连接池"""
+        loop, self._connector_loop = self._connector_loop, None
+        entry = _CONNECTOR_REGISTRY.get(loop) if loop is not None else None
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del _CONNECTOR_REGISTRY[loop]
+            await entry[0].close()
 
     def create_session(self, **kwargs):
-        return aiohttp.ClientSession(**kwargs, loop=self._loop)
+        # 账单下载的响应可能有数MB, 总时长沿用 aiohttp 默认的300秒, 只收紧连接和读取的超时
+        timeout = kwargs.pop('timeout', None) or aiohttp.ClientTimeout(
+            total=300,
+            sock_connect=30,
+            sock_read=60,
+        )
+        if 'connector' in kwargs:
+            return aiohttp.ClientSession(timeout=timeout, **kwargs)
+
+        loop = self._current_loop()
+        for closed in [lp for lp in _CONNECTOR_REGISTRY if lp.is_closed()]:
+            del _CONNECTOR_REGISTRY[closed]
+        entry = _CONNECTOR_REGISTRY.get(loop)
+        if entry is None or entry[0].closed:
+            entry = _CONNECTOR_REGISTRY[loop] = [
+                aiohttp.TCPConnector(
+                    limit=100,
+                    ttl_dns_cache=300,
+                    keepalive_timeout=75,
+                    enable_cleanup_closed=True,
+                    loop=loop,
+                ),
+                0,
+            ]
+        entry[1] += 1
+        self._connector_loop = loop
+        return aiohttp.ClientSession(
+            connector=entry[0],
+            connector_owner=False,
+            timeout=timeout,
+            **kwargs
+        )
+
+
+Client._runners = _collect_runners(Client)
@@ -8,12 +8,13 @@ import time
 import logging
 import hashlib
 import asyncio
+import secrets
 
-from typing import Optional, Union
+from typing import List, Optional, Union
 
 from aioweixin.client import Client, runner
 from aioweixin.errors import WeixinError
-from aioweixin.utils import to_xml, to_dict, rand_str
+from aioweixin.utils import to_xml, to_dict
 
 
 logger = logging.getLogger(__name__)
@@ -21,12 +22,40 @@ logger = logging.getLogger(__name__)
 __all__ = ("WeixinPay", "Status", "TradeType", "BillType", "AccountType", "SignMethod",
            "CheckName")
 
+_XML_HEADERS = {"Content-Type": "application/xml"}
+_BINARY_TYPES = frozenset((
+    "application/octet-stream",
+    "application/gzip",
+    "application/x-gzip",
+    "application/zip",
+))
+_ESC_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+
+
+def _client_ssl(cert: str, key: str) -> ssl.SSLContext:
+    """用商户证书发起双向认证的客户端 `SSLContext`, 同时校验微信支付服务端证书"""
+    ctx = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+    ctx.load_cert_chain(cert, key)
+    return ctx
+
+
+def _xml_value(v: str) -> str:
+    if v.isdigit():
+        return v
+    if "]]>" in v:
+        return v.translate(_ESC_TABLE)
+    return f"<![CDATA[{v}]]>"
+
 
 class Status(enum.Enum):
     SUCCESS = "SUCCESS"
     FAIL = "FAIL"
 
 
+_STATUS_SUCCESS = Status.SUCCESS.value
+_STATUS_FAIL = Status.FAIL.value
+
+
 class TradeType(enum.Enum):
     APP = "APP"
     JSAPI = "JSAPI"
@@ -90,50 +119,97 @@ class WeixinPay(Client):
         self._app_id = app_id
         self._mch_id = mch_id
         self._mch_key = mch_key
+        self._mch_key_bytes = mch_key.encode("utf-8")
         self._notify_url = notify_url
         self._refund_notify_url = refund_notify_url or notify_url
         self._key = key
         self._cert = cert
-        self._ssl = None
+        self._ssl = _client_ssl(cert, key) if cert and key else None
+        self._refresh_urls()
         super().__init__(mode=mode, loop=loop, **kwargs)
 
+    def _refresh_urls(self):
+        """缓存各接口地址, :attr:`API_HOST` 变化后需要重新调用"""
+        self._url_getsignkey = self.API_HOST + "/pay/getsignkey"
+        self._url_unifiedorder = self.API_HOST + "/pay/unifiedorder"
+        self._url_orderquery = self.API_HOST + "/pay/orderquery"
+        self._url_closeorder = self.API_HOST + "/pay/closeorder"
+        self._url_refund = self.API_HOST + "/pay/refund"
+        self._url_refundquery = self.API_HOST + "/pay/refundquery"
+        self._url_downloadbill = self.API_HOST + "/pay/downloadbill"
+        self._url_downloadfundflow = self.API_HOST + "/pay/downloadfundflow"
+        self._url_transfers = self.API_HOST + "/mmpaymkttransfers/promotion/transfers"
+        self._url_gettransferinfo = self.API_HOST + "/mmpaymkttransfers/gettransferinfo"
+        self._url_pay_bank = self.API_HOST + "/mmpaysptrans/pay_bank"
+        self._url_query_bank = self.API_HOST + "/mmpaysptrans/query_bank"
+        self._url_getpublickey = self.FRAUD_HOST + "/risk/getpublickey"
+
     @property
     def ssl(self):
-        if self._ssl:
-            return self._ssl
-        if not self._cert or not self._key:
-            return None
-        self._ssl = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-        self._ssl.load_cert_chain(self._cert, self._key)
         return self._ssl
 
     @ssl.setter
-    def ssl(self, key, cert):
-        self._key = key
-        self._cert = cert
-        self._ssl = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-        self._ssl.load_cert_chain(self._cert, self._key)
+    def ssl(self, value):
+        """
+        设置证书, ``client.ssl = (key, cert)``
+        """
+        self._key, self._cert = value
+        self._ssl = _client_ssl(self._cert, self._key)
 
     @property
     def nonce_str(self):
-        return rand_str(32)
+        return secrets.token_hex(16)
 
     def sign(
         self,
         data: dict,
         method: SignMethod = SignMethod.MD5
     ) -> str:
-        data = [(k, "{0}".format(v)) for k, v in data.items()]
-        data.sort(key=lambda x: x[0])
-        s = "&".join("=".join(kv) for kv in data if kv[1])
-        s += "&key={0}".format(self._mch_key)
-        enc = s.encode("utf-8")
+        return self._sign_items(data, method)
+
+    def _sign_items(
+        self,
+        data: dict,
+        method: SignMethod,
+        fragments: Optional[list] = None,
+    ) -> str:
+        """
+        遍历排序后的参数生成签名, 传入 `fragments` 时同时追加每个参数的 `xml` 节点
+        """
+        buf = bytearray()
+        for k, v in sorted(data.items()):
+            if v in (None, ""):
+                continue
+            v = str(v)
+            buf += k.encode("utf-8")
+            buf += b"="
+            buf += v.encode("utf-8")
+            buf += b"&"
+            if fragments is not None:
+                fragments.append(f"<{k}>{_xml_value(v)}</{k}>".encode("utf-8"))
+        buf += b"key="
+        buf += self._mch_key_bytes
         if method == SignMethod.MD5:
-            return hashlib.md5(enc).hexdigest().upper()
+            return hashlib.md5(buf).hexdigest().upper()
         elif method == SignMethod.HMAC_SHA256:
-            return hmac.new(self._mch_key, enc, hashlib.sha256).hexdigest().upper()
+            return hmac.new(self._mch_key_bytes, buf, hashlib.sha256).hexdigest().upper()
         raise ValueError("invalid sign method")
 
+    def _build_signed_xml(
+        self,
+        data: dict,
+        method: SignMethod = SignMethod.MD5
+    ) -> bytes:
+        """
+        一次遍历同时生成签名串和请求的 `xml` 内容
+
+        微信支付的请求都是单层的 `<xml><k>v</k>...</xml>`, 直接拼接已编码的节点而不走通用的 `xml` 序列化
+        """
+        fragments = [b"<xml>"]
+        sign = self._sign_items(data, method, fragments)
+        fragments.append(f"<sign>{sign}</sign></xml>".encode("ascii"))
+        return b"".join(fragments)
+
     def check(
         self,
         data: dict,
@@ -152,8 +228,8 @@ class WeixinPay(Client):
         :param msg: 回复消息
         :param ok: 成功或者失败
         """
-        code = Status.SUCCESS if ok else Status.FAIL
-        return to_dict(dict(return_code=code.value, return_msg=msg))
+        code = _STATUS_SUCCESS if ok else _STATUS_FAIL
+        return to_xml(dict(return_code=code, return_msg=msg))
 
     async def do(
         self,
@@ -161,32 +237,38 @@ class WeixinPay(Client):
         data: dict,
         *,
         method: SignMethod = SignMethod.MD5
-    ) -> Union[str, dict]:
+    ) -> Union[str, bytes, dict]:
         """
         构建请求并且解析响应
 
         - 填充默认参数 `nonce_str`
         - 自动签名, 并且填充 `sign` 参数
         - 解析响应内容 `xml` 为 `dict`
+        - 明确为二进制的响应(例如 `GZIP` 账单)直接返回 `bytes`, 其余非 `xml` 的响应按类型返回 `str` 或 `bytes`
         - 判断响应是否出错，出错抛出后异常 :class:`aioweixin.errors.WeixinError`
 
         :param url: 请求地址
         :param data: 请求数据
         """
         data.setdefault("nonce_str", self.nonce_str)
-        data.setdefault("sign", self.sign(data, method))
         if method != SignMethod.MD5:
             data.setdefault("sign_type", method.value)
-        logger.debug("request url: %s, data: %s", url, data)
-        async with self.session.post(url, data=to_xml(data), ssl=self.ssl) as resp:
-            content = await resp.text()
+        body = self._build_signed_xml(data, method)
+        logger.debug("request url: %s, data: %s", url, body)
+        async with self.session.post(url, data=body, headers=_XML_HEADERS, ssl=self._ssl) as resp:
+            ctype = resp.headers.get("Content-Type", "").split(";", 1)[0].strip().lower()
+            if ctype in _BINARY_TYPES:
+                return await resp.read()
+            content = await resp.read()
             logger.debug("response content: %s", content)
-            if "xml" not in content:
+            if content[:64].lstrip()[:5] not in (b"<xml>", b"<?xml"):
+                if ctype.startswith("text/"):
+                    return content.decode(resp.get_encoding())
                 return content
             data = to_dict(content)
-            if data["return_code"] == Status.FAIL.value:
+            if data["return_code"] == _STATUS_FAIL:
                 raise WeixinError(data["return_code"], data.get("return_msg", data.get("retmsg", "")))
-            if data.get("result_code", "") == Status.FAIL.value:
+            if data.get("result_code") == _STATUS_FAIL:
                 raise WeixinError(data["result_code"], data["err_code_des"])
             return data
 
@@ -200,17 +282,19 @@ class WeixinPay(Client):
         `微信文档 <https://pay.weixin.qq.com/wiki/doc/api/jsapi.php?chapter=23_1>`_
         """
         self.API_HOST += "/sandboxnew"
-        url = self.API_HOST + "/pay/getsignkey"
+        self._refresh_urls()
+        url = self._url_getsignkey
         data = {"mch_id": self._mch_id}
         resp = await self.do(url, data)
         self._mch_key = resp["sandbox_signkey"]
+        self._mch_key_bytes = self._mch_key.encode("utf-8")
         return self
 
     @runner
     async def public_key(self) -> dict:
         """
         """
-        url = FRAUD_HOST + "/risk/getpublickey"
+        url = self._url_getpublickey
         data = {"mch_id": self._mch_id, "sign_type": SignMethod.MD5.value}
         resp = await self.do(url, data)
         return resp["pub_key"]
@@ -227,26 +311,27 @@ class WeixinPay(Client):
         product_id: Optional[str] = None,
         **kwargs,
     ) -> dict:
-        kwargs.setdefault("out_trade_no", out_trade_no)
-        kwargs.setdefault("trade_type", trade_type.value)
-        kwargs.setdefault("total_fee", total_fee)
-        kwargs.setdefault("body", body)
-        kwargs.setdefault("spbill_create_ip", spbill_create_ip)
-        if trade_type == TradeType.JSAPI:
-            if not openid:
-                raise WeixinError("FAIL", "openid required")
-            kwargs.setdefault("openid", openid)
-        elif trade_type == TradeType.NATIVE:
-            if not product_id:
-                raise WeixinError("FAIL", "product_id required")
-            kwargs.setdefault("product_id", product_id)
-
-        # 填写默认参数
-        url = self.API_HOST + "/pay/unifiedorder"
-        kwargs.setdefault("appid", self._app_id)
-        kwargs.setdefault("mch_id", self._mch_id)
-        kwargs.setdefault("notify_url", self._notify_url)
-        return await self.do(url, kwargs)
+        if trade_type == TradeType.JSAPI and not openid:
+            raise WeixinError("FAIL", "openid required")
+        if trade_type == TradeType.NATIVE and not product_id:
+            raise WeixinError("FAIL", "product_id required")
+
+        # 填写默认参数, 调用方传入的参数优先
+        url = self._url_unifiedorder
+        data = {
+            "out_trade_no": out_trade_no,
+            "trade_type": trade_type.value,
+            "total_fee": total_fee,
+            "body": body,
+            "spbill_create_ip": spbill_create_ip,
+            "openid": openid if trade_type == TradeType.JSAPI else None,
+            "product_id": product_id if trade_type == TradeType.NATIVE else None,
+            "appid": self._app_id,
+            "mch_id": self._mch_id,
+            "notify_url": self._notify_url,
+            **kwargs,
+        }
+        return await self.do(url, data)
 
     @runner
     async def unified_order(
@@ -277,7 +362,7 @@ class WeixinPay(Client):
         :param openid: 用户唯一id,当 `trade_type` == `JSAPI` 时候必传
         :param product_id: 此参数为二维码中包含的商品ID,当 `trade_type` == `NATIVE` 时候必传
         """
-        return self._unified_order(
+        return await self._unified_order(
             out_trade_no, trade_type, total_fee, body, spbill_create_ip,
             openid=openid, product_id=product_id, **kwargs
         )
@@ -350,14 +435,45 @@ class WeixinPay(Client):
         if not out_trade_no and not transaction_id:
             raise WeixinError("FAIL", "out_trade_no or transaction_id required")
 
-        kwargs = {}
-        out_trade_no and kwargs.setdefault("out_trade_no", out_trade_no)
-        transaction_id and kwargs.setdefault("transaction_id", transaction_id)
+        url = self._url_orderquery
+        data = {
+            "out_trade_no": out_trade_no,
+            "transaction_id": transaction_id,
+            "appid": self._app_id,
+            "mch_id": self._mch_id,
+        }
+        return await self.do(url, data)
+
+    @runner
+    async def bulk_order_query(
+        self,
+        out_trade_nos: List[str],
+        concurrency: int = 50,
+    ) -> List[dict]:
+        """
+        批量查询订单
+
+        并发调用 :meth:`order_query`, 返回结果与 `out_trade_nos` 顺序一致, 任一查询出错则取消其余查询并抛出该异常
+
+        :param out_trade_nos: 商户订单号列表
+        :param concurrency: 最大并发数, 不要超过微信支付的频率限制
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        sem = asyncio.Semaphore(concurrency)
+        order_query = type(self).order_query
+
+        async def _one(out_trade_no):
+            async with sem:
+                return await order_query(self, out_trade_no=out_trade_no)
 
-        url = self.API_HOST + "/pay/orderquery"
-        kwargs.setdefault("appid", self._app_id)
-        kwargs.setdefault("mch_id", self._mch_id)
-        return await self.do(url, kwargs)
+        tasks = [asyncio.ensure_future(_one(n)) for n in out_trade_nos]
+        try:
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            raise
 
     @runner
     async def close_order(
@@ -375,12 +491,14 @@ class WeixinPay(Client):
 
         :param out_trade_no: 商户订单号
         """
-        kwargs.setdefault("out_trade_no", out_trade_no)
-
-        url = self.API_HOST + "/pay/closeorder"
-        kwargs.setdefault("appid", self._app_id)
-        kwargs.setdefault("mch_id", self._mch_id)
-        return await self.do(url, kwargs)
+        url = self._url_closeorder
+        data = {
+            "out_trade_no": out_trade_no,
+            "appid": self._app_id,
+            "mch_id": self._mch_id,
+            **kwargs,
+        }
+        return await self.do(url, data)
 
 
     @runner
@@ -417,17 +535,19 @@ class WeixinPay(Client):
         :param notify_url: 退款成功回调地址, 可选, 如果 :attr:`~WeixinPay.refund_notify_url` 存在，则为默认值
         """
 
-        kwargs.setdefault("out_refund_no", out_refund_no)
-        kwargs.setdefault("total_fee", total_fee)
-        kwargs.setdefault("refund_fee", refund_fee)
-        out_trade_no and kwargs.setdefault("out_trade_no", out_trade_no)
-        transaction_id and kwargs.setdefault("transaction_id", transaction_id)
-
-        url = self.API_HOST + "/pay/refund"
-        kwargs.setdefault("notify_url", self._refund_notify_url)
-        kwargs.setdefault("appid", self._app_id)
-        kwargs.setdefault("mch_id", self._mch_id)
-        return await self.do(url, kwargs)
+        url = self._url_refund
+        data = {
+            "out_refund_no": out_refund_no,
+            "total_fee": total_fee,
+            "refund_fee": refund_fee,
+            "out_trade_no": out_trade_no,
+            "transaction_id": transaction_id,
+            "notify_url": self._refund_notify_url,
+            "appid": self._app_id,
+            "mch_id": self._mch_id,
+            **kwargs,
+        }
+        return await self.do(url, data)
 
     @runner
     async def refund_query(
@@ -451,18 +571,19 @@ class WeixinPay(Client):
         :param out_trade_no: 商户订单号
         :param transaction_id: 微信订单号,参数需要四选一
         """
-        kwargs = {}
-        out_trade_no and kwargs.setdefault("out_trade_no", out_trade_no)
-        transaction_id and kwargs.setdefault("transaction_id", transaction_id)
-        refund_id and kwargs.setdefault("refund_id", refund_id)
-        out_refund_no and kwargs.setdefault("out_refund_no", out_refund_no)
-        if not kwargs:
+        if not (out_trade_no or transaction_id or refund_id or out_refund_no):
             raise WeixinError("FAIL", "invalid argument")
 
-        url = self.API_HOST + "/pay/refundquery"
-        kwargs.setdefault("appid", self._app_id)
-        kwargs.setdefault("mch_id", self._mch_id)
-        return await self.do(url, kwargs)
+        url = self._url_refundquery
+        data = {
+            "out_trade_no": out_trade_no,
+            "transaction_id": transaction_id,
+            "refund_id": refund_id,
+            "out_refund_no": out_refund_no,
+            "appid": self._app_id,
+            "mch_id": self._mch_id,
+        }
+        return await self.do(url, data)
 
     @runner
     async def download_bill(
@@ -470,7 +591,7 @@ class WeixinPay(Client):
         bill_date: str,
         bill_type: BillType = BillType.ALL,
         tar_type: Optional[str] = None,
-    ) -> str:
+    ) -> Union[str, bytes]:
         """
         下载对账单
 
@@ -489,15 +610,15 @@ class WeixinPay(Client):
         :param bill_type: 账单类型
         :param tar_type: 压缩类型，为空或者GZIP
         """
-        kwargs = {}
-        kwargs.setdefault("bill_date", bill_date)
-        kwargs.setdefault("bill_type", bill_type.value)
-        tar_type and kwargs.setdefault("tar_type", tar_type)
-
-        url = self.API_HOST + "/pay/downloadbill"
-        kwargs.setdefault("appid", self._app_id)
-        kwargs.setdefault("mch_id", self._mch_id)
-        return await self.do(url, kwargs)
+        url = self._url_downloadbill
+        data = {
+            "bill_date": bill_date,
+            "bill_type": bill_type.value,
+            "tar_type": tar_type,
+            "appid": self._app_id,
+            "mch_id": self._mch_id,
+        }
+        return await self.do(url, data)
 
     @runner
     async def download_fund_flow(
@@ -505,7 +626,7 @@ class WeixinPay(Client):
         bill_date: str,
         account_type: AccountType = AccountType.BASIC,
         tar_type: Optional[str] = None,
-    ) -> str:
+    ) -> Union[str, bytes]:
         """
         下载资金账单
 
@@ -515,15 +636,15 @@ class WeixinPay(Client):
         :param account_type: 账单的资金来源账户
         :param tar_type: 压缩类型，为空或者GZIP
         """
-        kwargs = {}
-        kwargs.setdefault("bill_date", bill_date)
-        kwargs.setdefault("account_type", account_type.value)
-        tar_type and kwargs.setdefault("tar_type", tar_type)
-
-        url = self.API_HOST + "/pay/downloadfundflow"
-        kwargs.setdefault("appid", self._app_id)
-        kwargs.setdefault("mch_id", self._mch_id)
-        return await self.do(url, kwargs, method=SignMethod.HMAC_SHA256)
+        url = self._url_downloadfundflow
+        data = {
+            "bill_date": bill_date,
+            "account_type": account_type.value,
+            "tar_type": tar_type,
+            "appid": self._app_id,
+            "mch_id": self._mch_id,
+        }
+        return await self.do(url, data, method=SignMethod.HMAC_SHA256)
 
     @runner
     async def pay_pocket(
@@ -551,18 +672,20 @@ class WeixinPay(Client):
         :param check_name: 是否校验实名
         :param spbill_create_ip: 可以为用户或者服务端ip
         """
-        kwargs.setdefault("partner_trade_no", partner_trade_no)
-        kwargs.setdefault("openid", openid)
-        kwargs.setdefault("amount", amount)
-        kwargs.setdefault("desc", desc)
-        kwargs.setdefault("check_name", check_name.value)
-        re_user_name and kwargs.setdefault("re_user_name", re_user_name)
-        spbill_create_ip and kwargs.setdefault("spbill_create_ip", spbill_create_ip)
-
-        url = self.API_HOST + "/mmpaymkttransfers/promotion/transfers"
-        kwargs.setdefault("mch_appid", self._app_id)
-        kwargs.setdefault("mch_id", self._mch_id)
-        return await self.do(url, kwargs)
+        url = self._url_transfers
+        data = {
+            "partner_trade_no": partner_trade_no,
+            "openid": openid,
+            "amount": amount,
+            "desc": desc,
+            "check_name": check_name.value,
+            "re_user_name": re_user_name,
+            "spbill_create_ip": spbill_create_ip,
+            "mch_appid": self._app_id,
+            "mch_id": self._mch_id,
+            **kwargs,
+        }
+        return await self.do(url, data)
 
     @runner
     async def query_pocket(
@@ -577,12 +700,13 @@ class WeixinPay(Client):
         :param partner_trade_no: 商户订单号，需保持唯一性
         """
 
-        kwargs = {"partner_trade_no": partner_trade_no}
-
-        url = self.API_HOST + "/mmpaymkttransfers/gettransferinfo"
-        kwargs.setdefault("appid", self._app_id)
-        kwargs.setdefault("mch_id", self._mch_id)
-        return await self.do(url, kwargs)
+        url = self._url_gettransferinfo
+        data = {
+            "partner_trade_no": partner_trade_no,
+            "appid": self._app_id,
+            "mch_id": self._mch_id,
+        }
+        return await self.do(url, data)
 
     @runner
     async def pay_bank(
@@ -606,16 +730,17 @@ class WeixinPay(Client):
         :param amount: 金额, 分
         :param desc: 企业付款备注
         """
-        kwargs = {}
-        kwargs.setdefault("partner_trade_no", partner_trade_no)
-        kwargs.setdefault("enc_bank_no", enc_bank_no)
-        kwargs.setdefault("enc_true_name", enc_true_name)
-        kwargs.setdefault("bank_code", bank_code)
-        kwargs.setdefault("amount", amount)
-        kwargs.setdefault("desc", desc)
-
-        url = self.API_HOST + "/mmpaysptrans/pay_bank"
-        kwargs.setdefault("mch_id", self._mch_id)
+        url = self._url_pay_bank
+        data = {
+            "partner_trade_no": partner_trade_no,
+            "enc_bank_no": enc_bank_no,
+            "enc_true_name": enc_true_name,
+            "bank_code": bank_code,
+            "amount": amount,
+            "desc": desc,
+            "mch_id": self._mch_id,
+        }
+        return await self.do(url, data)
 
     @runner
     async def query_bank(
@@ -630,9 +755,10 @@ class WeixinPay(Client):
         :param partner_trade_no: 商户订单号，需保持唯一性
         """
 
-        kwargs = {"partner_trade_no": partner_trade_no}
-
-        url = self.API_HOST + "/mmpaysptrans/query_bank"
-        kwargs.setdefault("appid", self._app_id)
-        kwargs.setdefault("mch_id", self._mch_id)
-        return await self.do(url, kwargs)
+        url = self._url_query_bank
+        data = {
+            "partner_trade_no": partner_trade_no,
+            "appid": self._app_id,
+            "mch_id": self._mch_id,
+        }
+        return await self.do(url, data)
@@ -1,25 +1,71 @@
 # -*- coding: utf-8 -*-
 
 
+import re
 import string
-import random
-import xmltodict
+import secrets
+
+try:
+    from xmltodict_rs import parse as _parse, unparse as _unparse
+except ImportError:
+    from xmltodict import parse as _parse, unparse as _unparse
 
 
 __all__ = ('rand_str', 'to_dict', 'to_xml')
 
 
+_ALPHABET = string.ascii_letters + string.digits
+
+# 微信支付的响应都是单层的 `<xml><k>v</k>...</xml>`, 逐个节点锚定匹配, 不会回溯到上一个节点
+_FLAT_HEAD = re.compile(r'\s*(?:<\?xml[^>]*\?>\s*)?<xml>')
+_FLAT_ITEM = re.compile(
+    r'\s*<(\w+)>'
+    r'(?:<!\[CDATA\[([^\]]*(?:\](?!\]>)[^\]]*)*)\]\]>|([^<&]*))'
+    r'</\1>'
+)
+_FLAT_TAIL = re.compile(r'\s*</xml>\s*')
+
+
 def rand_str(length):
-    char = string.ascii_letters + string.digits
-    return "".join(random.choice(char) for _ in range(length))
+    if length % 2 == 0:
+        return secrets.token_hex(length // 2)
+    return "".join(secrets.choice(_ALPHABET) for _ in range(length))
+
+
+def _parse_flat(content):
+    m = _FLAT_HEAD.match(content)
+    if m is None:
+        return None
+    pos = m.end()
+    data = {}
+    while True:
+        m = _FLAT_ITEM.match(content, pos)
+        if m is None:
+            break
+        value = m.group(2) if m.group(2) is not None else m.group(3)
+        data[m.group(1)] = value.strip() or None
+        pos = m.end()
+    if _FLAT_TAIL.fullmatch(content, pos) is None:
+        return None
+    return data
 
 
 def to_dict(content):
-    data = xmltodict.parse(content)
+    """
+    解析 `xml` 为 `dict`
+
+    :param content: `xml` 内容, `str` 或者 `bytes`
+    """
+    if isinstance(content, bytes):
+        content = content.decode("utf-8")
+    data = _parse_flat(content)
+    if data is not None:
+        return data
+    data = _parse(content)
     for k in data:
         return dict(data[k])
     return dict()
 
 
 def to_xml(data):
-    return xmltodict.unparse(dict(xml=data))
+    return _unparse(dict(xml=data))
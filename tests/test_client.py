@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+
+import asyncio
+import threading
+
+from aioweixin.client import Client, runner, _CONNECTOR_REGISTRY
+
+
+class Echo(Client):
+
+    @runner
+    async def current_loop(self):
+        await asyncio.sleep(0.05)
+        return asyncio.get_running_loop()
+
+
+def test_blocking_clients_in_threads():
+    loops, errors = [], []
+
+    def work():
+        try:
+            client = Echo(mode='blocking')
+            loops.append(client.current_loop())
+            loops.append(client.current_loop())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert len(loops) == 8
+    # 同一线程复用一个 event loop, 不同线程互不影响
+    assert len(set(map(id, loops))) == 4
+
+
+def test_blocking_clients_share_thread_loop():
+    a, b = Echo(mode='blocking'), Echo(mode='blocking')
+    assert a.current_loop() is b.current_loop()
+
+
+def test_shared_connector_closed_with_last_client():
+    async def main():
+        a, b = Client(), Client()
+        a.session, b.session
+        connector = a.session.connector
+        assert b.session.connector is connector
+        assert _CONNECTOR_REGISTRY[asyncio.get_running_loop()] == [connector, 2]
+
+        await a.close()
+        assert not connector.closed
+        assert _CONNECTOR_REGISTRY[asyncio.get_running_loop()][1] == 1
+
+        await b.close()
+        await b.close()
+        assert connector.closed
+        assert asyncio.get_running_loop() not in _CONNECTOR_REGISTRY
+
+    asyncio.run(main())
+
+
+def test_registry_evicts_closed_loops():
+    async def leak():
+        Client().session
+
+    for _ in range(5):
+        asyncio.run(leak())
+
+    async def main():
+        client = Client()
+        client.session
+        assert not any(loop.is_closed() for loop in _CONNECTOR_REGISTRY)
+        assert asyncio.get_running_loop() in _CONNECTOR_REGISTRY
+        await client.close()
+
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+
+import pytest
+
+from aioweixin.pay import WeixinPay, SignMethod
+from aioweixin.utils import to_dict
+
+
+@pytest.fixture
+def pay():
+    return WeixinPay("wx_app_id", "mch_id", "mch_key", "https://example.com/notify")
+
+
+def _round_trip(pay, data, method):
+    body = pay._build_signed_xml(dict(data), method)
+    parsed = to_dict(body)
+    sign = parsed.pop("sign")
+    assert sign == pay.sign(parsed, method)
+    assert sign == pay.sign(data, method)
+    return parsed
+
+
+@pytest.mark.parametrize("method", [SignMethod.MD5, SignMethod.HMAC_SHA256])
+def test_signed_xml_round_trip(pay, method):
+    data = {
+        "appid": "wx_app_id",
+        "mch_id": "mch_id",
+        "nonce_str": "5K8264ILTKCH16CQ2502SI8ZNMTM67VS",
+        "body": "腾讯充值中心-QQ会员充值 <a&b>",
+        "attach": "x]]>y",
+        "total_fee": 101,
+        "detail": "",
+        "openid": None,
+        "sign_type": method.value,
+    }
+    parsed = _round_trip(pay, data, method)
+    assert parsed == {
+        "appid": "wx_app_id",
+        "mch_id": "mch_id",
+        "nonce_str": "5K8264ILTKCH16CQ2502SI8ZNMTM67VS",
+        "body": "腾讯充值中心-QQ会员充值 <a&b>",
+        "attach": "x]]>y",
+        "total_fee": "101",
+        "sign_type": method.value,
+    }
+
+
+def test_signed_xml_body(pay):
+    body = pay._build_signed_xml({"total_fee": 101, "body": "a<b", "attach": "x]]>y"})
+    assert body.startswith(b"<xml><attach>x]]&gt;y</attach><body><![CDATA[a<b]]></body><total_fee>101</total_fee><sign>")
+    assert body.endswith(b"</sign></xml>")
+
+
+def test_sign_md5():
+    # 微信支付文档中的签名示例
+    pay = WeixinPay("wxd930ea5d5a258f4f", "10000100", "192006250b4c09247ec02edce69f6a2d", "")
+    data = {
+        "appid": "wxd930ea5d5a258f4f",
+        "mch_id": "10000100",
+        "device_info": 1000,
+        "body": "test",
+        "nonce_str": "ibuaiVcKdpRxkhJA",
+        "attach": "",
+    }
+    assert pay.sign(data) == "9A0A8659F005D6984697E2CA0A9CF3B7"
+
+
+def test_sign_invalid_method(pay):
+    with pytest.raises(ValueError):
+        pay.sign({"a": 1}, "SHA1")
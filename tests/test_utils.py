@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+
+import time
+
+import pytest
+
+from xml.parsers.expat import ExpatError
+
+from aioweixin.utils import to_dict, _parse_flat
+
+
+def test_to_dict_flat():
+    content = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<xml>\n'
+        '  <return_code><![CDATA[SUCCESS]]></return_code>\n'
+        '  <return_msg>OK</return_msg>\n'
+        '  <total_fee>101</total_fee>\n'
+        '  <attach></attach>\n'
+        '  <body><![CDATA[a<b>&c]]></body>\n'
+        '</xml>\n'
+    )
+    assert to_dict(content) == {
+        "return_code": "SUCCESS",
+        "return_msg": "OK",
+        "total_fee": "101",
+        "attach": None,
+        "body": "a<b>&c",
+    }
+
+
+def test_to_dict_bytes():
+    content = "<xml><body><![CDATA[中文]]></body></xml>".encode("utf-8")
+    assert to_dict(content) == {"body": "中文"}
+
+
+def test_to_dict_empty():
+    assert to_dict("<xml></xml>") == {}
+
+
+def test_to_dict_strips_whitespace():
+    content = "<xml>\n  <return_code>\n    FAIL\n  </return_code>\n</xml>"
+    assert to_dict(content) == {"return_code": "FAIL"}
+
+
+def test_to_dict_cdata_brackets():
+    content = "<xml><a><![CDATA[x]]]></a><b><![CDATA[]</b>]]></b></xml>"
+    assert to_dict(content) == {"a": "x]", "b": "]</b>"}
+
+
+@pytest.mark.parametrize("content", [
+    "<xml><a>x&amp;y</a></xml>",
+    "<xml><a><b>1</b></a></xml>",
+    "<xml><a/></xml>",
+])
+def test_to_dict_fallback(content):
+    assert _parse_flat(content) is None
+    assert to_dict(content)
+
+
+def test_to_dict_unclosed_cdata_is_linear():
+    content = "<xml>" + "<a><![CDATA[x]]></a>" * 5000 + "<b>"
+    start = time.perf_counter()
+    assert _parse_flat(content) is None
+    assert time.perf_counter() - start < 1
+    with pytest.raises(ExpatError):
+        to_dict(content)